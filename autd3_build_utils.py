@@ -1,4 +1,8 @@
 import contextlib
+import fnmatch
+import functools
+import http.client
+import mmap
 import os
 import platform
 import re
@@ -6,11 +10,48 @@ import shutil
 import subprocess
 import sys
 import tarfile
+import tempfile
+import time
+import urllib.error
 import urllib.request
-from collections.abc import Generator
+import zipfile
+from collections.abc import Callable, Generator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Self
 
+try:
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+
+_RETRY_STATUS = (500, 502, 503, 504)
+_COPY_BUFSIZE = 1024 * 1024
+_SPOOL_MAX_SIZE = 256 * 1024 * 1024
+_GROUP_REF_RE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+_SYSTEM = platform.system()
+_MACHINE = platform.machine().lower()
+_ARCH_ALIASES = {
+    "amd64": "x64",
+    "x86_64": "x64",
+    "x64": "x64",
+    "arm64": "aarch64",
+    "aarch64": "aarch64",
+    "arm32": "armv7l",
+    "armv7l": "armv7l",
+}
+_URL_SUFFIXES = {
+    ("Windows", "x64"): "win-x64",
+    ("Windows", "aarch64"): "win-aarch64",
+    ("Darwin", "x64"): "macos-aarch64",
+    ("Darwin", "aarch64"): "macos-aarch64",
+    ("Linux", "x64"): "linux-x64",
+    ("Linux", "aarch64"): "linux-armv7",
+    ("Linux", "armv7l"): "linux-aarch64",
+}
+_SHARED_LIB_EXTS = frozenset({".dll", ".dylib", ".so"})
+_STATIC_LIB_EXTS = frozenset({".lib", ".a"})
+
 
 def err(msg: str) -> None:
     print("\033[91mERR \033[0m: " + msg)
@@ -36,19 +77,21 @@ def working_dir(path: Path) -> Generator:
 
 @contextlib.contextmanager
 def with_env(**kwargs: str) -> Generator:
-    env = os.environ.copy()
-    for key, value in kwargs.items():
-        os.environ[key] = value
+    prev = {key: os.environ.get(key) for key in kwargs}
+    os.environ.update(kwargs)
     try:
         yield
     finally:
-        os.environ.clear()
-        os.environ.update(env)
+        for key, value in prev.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
 
 
-def run_command(command: list[str], *, shell: bool = False) -> None:
+def run_command(command: list[str], *, shell: bool = False, cwd: Path | str | None = None) -> None:
     try:
-        subprocess.run(command, check=False, shell=shell).check_returncode()
+        subprocess.run(command, check=False, shell=shell, cwd=cwd).check_returncode()
     except subprocess.CalledProcessError:
         err(f"command failed: {' '.join(command)}")
         sys.exit(-1)
@@ -56,22 +99,62 @@ def run_command(command: list[str], *, shell: bool = False) -> None:
 
 def fetch_submodule(*, recursive: bool = False) -> None:
     if shutil.which("git") is not None:
-        command = ["git", "submodule", "update", "--init"]
+        jobs = str(min(8, os.cpu_count() or 1))
+        command = ["git", "submodule", "update", "--init", "--jobs", jobs]
         if recursive:
+            command[1:1] = ["-c", f"submodule.fetchJobs={jobs}"]
             command.append("--recursive")
         run_command(command)
     else:
         err("git is not installed. Skip fetching submodules.")
 
 
+def _remove_tree(path: str) -> None:
+    with os.scandir(path) as it:
+        for entry in it:
+            with contextlib.suppress(PermissionError):
+                if entry.is_dir(follow_symlinks=False):
+                    _remove_tree(entry.path)
+                else:
+                    os.unlink(entry.path)  # noqa: PTH108
+    os.rmdir(path)  # noqa: PTH106
+
+
 def _remove(path: Path) -> None:
     with contextlib.suppress(PermissionError):
-        if path.is_file():
+        if path.is_dir() and not path.is_symlink():
+            _remove_tree(os.fspath(path))
+        else:
             path.unlink(missing_ok=True)
-        elif path.is_dir():
-            for f in path.iterdir():
-                _remove(f)
-            path.rmdir()
+
+
+def _compile_glob(pattern: str) -> Callable[[str], re.Match | None]:
+    return re.compile(fnmatch.translate(os.path.normcase(pattern))).match
+
+
+def _is_multi_segment(pattern: str) -> bool:
+    return any(sep in pattern for sep in ("/", os.sep, os.altsep) if sep)
+
+
+def _walk_matches(path: Path, pattern: str, exclude: str | None) -> Generator[Path]:
+    include_match = _compile_glob(pattern)
+    exclude_match = _compile_glob(exclude) if exclude is not None else None
+    for root, dirs, files in os.walk(path):
+        matched = {
+            name
+            for name in (*dirs, *files)
+            if include_match(os.path.normcase(name)) and not (exclude_match is not None and exclude_match(os.path.normcase(name)))
+        }
+        yield from (Path(root, name) for name in matched)
+        dirs[:] = [d for d in dirs if d not in matched]
+
+
+def _rglob_matches(path: Path, pattern: str, exclude: str | None) -> set[Path]:
+    paths = set(path.rglob(pattern))
+    if exclude is not None:
+        paths -= set(path.rglob(exclude))
+    # entries inside a matched directory are removed along with it
+    return {p for p in paths if not any(parent in paths for parent in p.parents)}
 
 
 def rremove(pattern: str, *, path: Path | str | None = None, exclude: str | None = None) -> None:
@@ -84,11 +167,36 @@ def rremove(pattern: str, *, path: Path | str | None = None, exclude: str | None
     if path.is_file():
         path.unlink(missing_ok=True)
     elif path.is_dir():
-        paths = set(path.rglob(pattern))
-        if exclude is not None:
-            paths -= set(path.rglob(exclude))
-        for f in paths:
-            _remove(f)
+        if _is_multi_segment(pattern) or (exclude is not None and _is_multi_segment(exclude)):
+            matches = _rglob_matches(path, pattern, exclude)
+        else:
+            matches = _walk_matches(path, pattern, exclude)
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            futures = [executor.submit(_remove, p) for p in matches]
+            for future in futures:
+                future.result()
+
+
+def _urlopen(url: str, *, retries: int = 5, backoff_factor: float = 0.5) -> http.client.HTTPResponse:
+    for attempt in range(retries):
+        try:
+            return urllib.request.urlopen(url)
+        except urllib.error.HTTPError as e:
+            if e.code not in _RETRY_STATUS:
+                raise
+        except urllib.error.URLError:
+            pass
+        delay = backoff_factor * 2**attempt
+        warn(f"failed to download {url}, retrying in {delay} s...")
+        time.sleep(delay)
+    return urllib.request.urlopen(url)
+
+
+def _move(src: Path, dst: Path) -> None:
+    try:
+        src.replace(dst)
+    except OSError:
+        shutil.move(src, dst)
 
 
 def remove(path: Path | str) -> None:
@@ -98,44 +206,79 @@ def remove(path: Path | str) -> None:
         path.rmdir()
 
 
+def _read_text(path: Path) -> str:
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = str(mm, encoding="utf-8")
+    # same universal newline translation as Path.read_text
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _combine_patterns(mapping: list[tuple[str, str]], flags: re.RegexFlag) -> re.Pattern | None:
+    # wrapping each key in a named group shifts its group numbers, so keys with group references are not combined
+    if not mapping or any(_GROUP_REF_RE.search(key) for key, _ in mapping):
+        return None
+    try:
+        return re.compile("|".join(f"(?P<_k{i}>{key})" for i, (key, _) in enumerate(mapping)), flags)
+    except re.error:
+        return None
+
+
 def substitute_in_file(
     src_file: Path | str,
     mapping: list[tuple[str, str]],
     *,
     target_file: Path | str | None = None,
     flags: re.RegexFlag = re.NOFLAG,
+    single_pass: bool = False,
 ) -> None:
     src_file = Path(src_file)
     target_file = Path(target_file) if target_file is not None else Path(src_file)
-    content = src_file.read_text(encoding="utf-8")
-    for key, value in mapping:
-        content = re.sub(key, value, content, flags=flags)
+    patterns = [(re.compile(key, flags), value) for key, value in mapping]
+    content = _read_text(src_file)
+    combined = _combine_patterns(mapping, flags) if single_pass else None
+    if combined is None:
+        for pattern, value in patterns:
+            content = pattern.sub(value, content)
+    else:
+
+        def _sub(m: re.Match) -> str:
+            pattern, value = patterns[int(m.lastgroup[2:])]
+            return pattern.match(content, m.start()).expand(value)
+
+        content = combined.sub(_sub, content)
     target_file.write_text(content, encoding="utf-8")
 
 
+@functools.cache
+def _is_npcap_installed() -> bool:
+    wpcap_exists = Path("C:\\Windows\\System32\\wpcap.dll").is_file() and Path("C:\\Windows\\System32\\Npcap\\wpcap.dll").is_file()
+    packet_exists = Path("C:\\Windows\\System32\\Packet.dll").is_file() and Path("C:\\Windows\\System32\\Npcap\\Packet.dll").is_file()
+
+    return wpcap_exists and packet_exists
+
+
 class BaseConfig:
     _platform: str
     arch: str
     release: bool
 
     def __init__(self: Self, args) -> None:  # noqa: ANN001
-        self._platform = platform.system()
+        self._platform = _SYSTEM
         if not self.is_windows() and not self.is_macos() and not self.is_linux():
-            err(f'platform "{platform.system()}" is not supported.')
+            err(f'platform "{_SYSTEM}" is not supported.')
             sys.exit(-1)
 
         self.release = getattr(args, "release", False) or False
 
         arch: str = getattr(args, "arch", None)
-        machine = platform.machine().lower()
+        machine = _MACHINE
         if arch is not None and arch:
             machine = arch.lower()
-        if machine in ["amd64", "x86_64", "x64"]:
-            self.arch = "x64"
-        elif machine in ["arm64", "aarch64"]:
-            self.arch = "aarch64"
-        elif machine in ["arm32", "armv7l"]:
-            self.arch = "armv7l"
+        if machine in _ARCH_ALIASES:
+            self.arch = _ARCH_ALIASES[machine]
         else:
             err(f"Unsupported platform: {machine}")
 
@@ -155,12 +298,9 @@ class BaseConfig:
         if not self.is_windows():
             return True
 
-        wpcap_exists = Path("C:\\Windows\\System32\\wpcap.dll").is_file() and Path("C:\\Windows\\System32\\Npcap\\wpcap.dll").is_file()
-        packet_exists = Path("C:\\Windows\\System32\\Packet.dll").is_file() and Path("C:\\Windows\\System32\\Npcap\\Packet.dll").is_file()
-
-        return wpcap_exists and packet_exists
+        return _is_npcap_installed()
 
-    def download_and_extract(  # noqa: C901, PLR0912
+    def download_and_extract(
         self: Self,
         repo: str,
         name: str,
@@ -169,53 +309,39 @@ class BaseConfig:
         *,
         ty: str = "shared",
     ) -> None:
-        url: str
-        base_url = f"https://github.com/shinolab/{repo}/releases/download/v{version}/{name}-v{version}"
-        if self.is_windows():
-            match self.arch:
-                case "x64":
-                    url = f"{base_url}-win-x64-{ty}.zip"
-                case "aarch64":
-                    url = f"{base_url}-win-aarch64-{ty}.zip"
-                case _:
-                    err(f"Unsupported platform: {platform.machine()}")
-        elif self.is_macos():
-            url = f"{base_url}-macos-aarch64-{ty}.tar.gz"
-        elif self.is_linux():
-            match self.arch:
-                case "x64":
-                    url = f"{base_url}-linux-x64-{ty}.tar.gz"
-                case "aarch64":
-                    url = f"{base_url}-linux-armv7-{ty}.tar.gz"
-                case "armv7l":
-                    url = f"{base_url}-linux-aarch64-{ty}.tar.gz"
-
-        tmp_file = Path("tmp.zip" if url.endswith(".zip") else "tmp.tar.gz")
-        urllib.request.urlretrieve(url, tmp_file)
-        if tmp_file.suffix == ".zip":
-            shutil.unpack_archive(tmp_file, ".")
+        suffix = _URL_SUFFIXES.get((self._platform, self.arch))
+        if suffix is None:
+            err(f"Unsupported platform: {self._platform} ({self.arch})")
+            sys.exit(-1)
+        ext = "zip" if self.is_windows() else "tar.gz"
+        url = f"https://github.com/shinolab/{repo}/releases/download/v{version}/{name}-v{version}-{suffix}-{ty}.{ext}"
+
+        if url.endswith(".zip"):
+            with _urlopen(url) as res, tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE) as buf:
+                shutil.copyfileobj(res, buf, _COPY_BUFSIZE)
+                buf.seek(0)
+                with zipfile.ZipFile(buf) as archive:
+                    archive.extractall()
         else:
-            with tarfile.open(tmp_file, "r:gz") as tar:
+            with _urlopen(url) as res, gzip.open(res, "rb") as gz, tarfile.open(fileobj=gz, mode="r|") as tar:
                 tar.extractall(filter="fully_trusted")
-        tmp_file.unlink()
 
         for dest_dir in dest_dirs:
             Path(dest_dir).mkdir(parents=True, exist_ok=True)
 
-        for dll in Path("bin").glob("*.dll"):
-            for dest_dir in dest_dirs:
-                shutil.copy(dll, dest_dir)
-        for dylib in Path("bin").glob("*.dylib"):
-            for dest_dir in dest_dirs:
-                shutil.copy(dylib, dest_dir)
-        for so in Path("bin").glob("*.so"):
-            for dest_dir in dest_dirs:
-                shutil.copy(so, dest_dir)
-        for lib in Path("lib").glob("*.lib"):
-            for dest_dir in dest_dirs:
-                shutil.copy(lib, dest_dir)
-        for a in Path("lib").glob("*.a"):
-            for dest_dir in dest_dirs:
-                shutil.copy(a, dest_dir)
+        if dest_dirs:
+            first, *rest = dest_dirs
+            for src_dir, exts in ((Path("bin"), _SHARED_LIB_EXTS), (Path("lib"), _STATIC_LIB_EXTS)):
+                if not src_dir.is_dir():
+                    continue
+                # symlinks first, so that their targets are still in place when they are copied
+                for f in sorted((p for p in src_dir.iterdir() if p.suffix in exts), key=lambda p: not p.is_symlink()):
+                    target = Path(first) / f.name
+                    if f.is_symlink():
+                        shutil.copyfile(f, target)
+                    else:
+                        _move(f, target)
+                    for dest_dir in rest:
+                        shutil.copyfile(target, Path(dest_dir) / f.name)
         remove("bin")
         remove("lib")
@@ -1,5 +1,10 @@
 import ast
+import io
 import re
+import sys
+from typing import ClassVar
+
+_GENERIC_RE = re.compile(r"Generic\[(.*)\]")
 
 
 class PyiGenerator(ast.NodeVisitor):
@@ -9,9 +14,8 @@ class PyiGenerator(ast.NodeVisitor):
         self.should_generate = False
 
     def get_generic_type(self, base: list[str]) -> str | None:
-        r = re.compile(r"Generic\[(.*)\]")
         for item in base:
-            if match := r.match(item):
+            if match := _GENERIC_RE.match(item):
                 return match.group(1)
         return None
 
@@ -32,61 +36,35 @@ class PyiGenerator(ast.NodeVisitor):
     def visit_ClassDef(self, node) -> None:  # noqa: ANN001, C901, N802, PLR0912, PLR0915
         class_name = node.name
         base_classes = [self._get_type_annotation(base) for base in node.bases]
-        full_class_name = f"{class_name}[{self.get_generic_type(base_classes)}]" if self.get_generic_type(base_classes) is not None else class_name
-        attributes = []
-        async_methods = []
-        methods = []
-        staticmethods = []
-        classmethods = []
-        properties = []
+        generic_type = self.get_generic_type(base_classes)
+        full_class_name = f"{class_name}[{generic_type}]" if generic_type is not None else class_name
+        members = {
+            "attributes": [],
+            "async_methods": [],
+            "methods": [],
+            "staticmethods": [],
+            "classmethods": [],
+            "properties": [],
+        }
 
         for body_item in node.body:
-            match body_item:
-                case ast.AnnAssign(target=ast.Name(id=attr_name), annotation=annotation):
-                    if not attr_name.startswith("_param_") and not attr_name.startswith("_prop_"):
-                        attr_type = self._get_type_annotation(annotation)
-                        attributes.append((attr_name, attr_type))
-                case ast.AsyncFunctionDef(
-                    name=method_name,
-                    args=ast.arguments(args=args, defaults=defaults),
-                    returns=returns,
-                    decorator_list=decorators,
-                ):
-                    return_type = self._get_type_annotation(returns)
-                    args = [(arg.arg, self._get_type_annotation(arg.annotation)) for arg in args[1:]]
-                    defaults = [self._get_value_expr(d) for d in defaults]
-                    async_methods.append((method_name, args, defaults, return_type))
-                case ast.FunctionDef(
-                    name=method_name,
-                    args=ast.arguments(posonlyargs=posonlyargs, args=args, defaults=defaults),
-                    returns=returns,
-                    decorator_list=decorators,
-                ):
-                    if any(d.id == "property" for d in decorators if isinstance(d, ast.Name)):
-                        return_type = self._get_type_annotation(returns)
-                        properties.append((method_name, return_type))
-                    elif any(d.id == "staticmethod" for d in decorators if isinstance(d, ast.Name)):
-                        return_type = self._get_type_annotation(returns)
-                        args = [(arg.arg, self._get_type_annotation(arg.annotation)) for arg in args]
-                        staticmethods.append((method_name, args, return_type))
-                    elif any(d.id == "classmethod" for d in decorators if isinstance(d, ast.Name)):
-                        return_type = self._get_type_annotation(returns)
-                        args = [(arg.arg, self._get_type_annotation(arg.annotation)) for arg in args[1:]]
-                        classmethods.append((method_name, args, return_type))
-                    else:
-                        return_type = self._get_type_annotation(returns)
-                        posonlyargs = [(arg.arg, self._get_type_annotation(arg.annotation)) for arg in posonlyargs[1:]]
-                        args = [(arg.arg, self._get_type_annotation(arg.annotation)) for arg in args[1:]]
-                        defaults = [self._get_value_expr(d) for d in defaults]
-                        methods.append((method_name, posonlyargs, args, defaults, return_type))
+            if (handler := self._BODY_HANDLERS.get(type(body_item))) is not None and (member := handler(self, body_item)) is not None:
+                kind, entry = member
+                members[kind].append(entry)
+
+        attributes = members["attributes"]
+        async_methods = members["async_methods"]
+        methods = members["methods"]
+        staticmethods = members["staticmethods"]
+        classmethods = members["classmethods"]
+        properties = members["properties"]
 
         if any(d.id == "builder" for d in node.decorator_list if isinstance(d, ast.Name)):
             self.should_generate = True
             fields = {}
             for class_node in node.body:
-                match class_node:
-                    case ast.AnnAssign(target=ast.Name(id=attr_name), annotation=annotation):
-                        fields[class_node.target.id] = self._get_type_annotation(class_node.annotation)
+                if type(class_node) is ast.AnnAssign and type(class_node.target) is ast.Name:
+                    fields[class_node.target.id] = self._get_type_annotation(class_node.annotation)
 
             for field_name, field_type in fields.items():
                 if field_name.startswith("_param_"):
@@ -238,63 +216,97 @@ class PyiGenerator(ast.NodeVisitor):
             case _:
                 return "None"
 
-    def _get_type_annotation(self, annotation):  # noqa: ANN001, ANN202, PLR0911
-        match annotation:
-            case ast.Name(id=id):
-                return id
-            case ast.Constant(value=value):
-                return str(value)
-            case ast.Subscript(value=value, slice=sl):
-                return f"{self._get_type_annotation(value)}[{self._get_type_annotation(sl)}]"
-            case ast.Tuple(elts=elts):
-                return f"{', '.join([self._get_type_annotation(elt) for elt in elts])}"
-            case ast.List(elts=elts):
-                return f"[{', '.join([self._get_type_annotation(elt) for elt in elts])}]"
-            case ast.BinOp(left=left, op=ast.BitOr(), right=right):
-                return f"{self._get_type_annotation(left)} | {self._get_type_annotation(right)}"
-            case ast.Attribute(value=value, attr=attr):
-                return f"{self._get_type_annotation(value)}.{attr}"
-            case None:
-                return "None"
-            case _:
-                return ""
+    def _get_type_annotation(self, annotation):  # noqa: ANN001, ANN202
+        if (handler := self._ANNOTATION_HANDLERS.get(type(annotation))) is not None:
+            return handler(self, annotation)
+        return ""
+
+    def _visit_attribute(self, item):  # noqa: ANN001, ANN202
+        if type(item.target) is not ast.Name:
+            return None
+        attr_name = item.target.id
+        if attr_name.startswith(("_param_", "_prop_")):
+            return None
+        return "attributes", (attr_name, self._get_type_annotation(item.annotation))
+
+    def _visit_async_method(self, item):  # noqa: ANN001, ANN202
+        return_type = self._get_type_annotation(item.returns)
+        args = [(arg.arg, self._get_type_annotation(arg.annotation)) for arg in item.args.args[1:]]
+        defaults = [self._get_value_expr(d) for d in item.args.defaults]
+        return "async_methods", (item.name, args, defaults, return_type)
+
+    def _visit_method(self, item):  # noqa: ANN001, ANN202
+        method_name = item.name
+        decorators = [d.id for d in item.decorator_list if isinstance(d, ast.Name)]
+        return_type = self._get_type_annotation(item.returns)
+        if "property" in decorators:
+            return "properties", (method_name, return_type)
+        if "staticmethod" in decorators:
+            args = [(arg.arg, self._get_type_annotation(arg.annotation)) for arg in item.args.args]
+            return "staticmethods", (method_name, args, return_type)
+        if "classmethod" in decorators:
+            args = [(arg.arg, self._get_type_annotation(arg.annotation)) for arg in item.args.args[1:]]
+            return "classmethods", (method_name, args, return_type)
+        posonlyargs = [(arg.arg, self._get_type_annotation(arg.annotation)) for arg in item.args.posonlyargs[1:]]
+        args = [(arg.arg, self._get_type_annotation(arg.annotation)) for arg in item.args.args[1:]]
+        defaults = [self._get_value_expr(d) for d in item.args.defaults]
+        return "methods", (method_name, posonlyargs, args, defaults, return_type)
+
+    _BODY_HANDLERS: ClassVar = {
+        ast.AnnAssign: _visit_attribute,
+        ast.AsyncFunctionDef: _visit_async_method,
+        ast.FunctionDef: _visit_method,
+    }
+
+    _ANNOTATION_HANDLERS: ClassVar = {
+        ast.Name: lambda _, a: sys.intern(a.id),
+        ast.Constant: lambda _, a: sys.intern(str(a.value)),
+        ast.Subscript: lambda self, a: f"{self._get_type_annotation(a.value)}[{self._get_type_annotation(a.slice)}]",
+        ast.Tuple: lambda self, a: ", ".join([self._get_type_annotation(elt) for elt in a.elts]),
+        ast.List: lambda self, a: f"[{', '.join([self._get_type_annotation(elt) for elt in a.elts])}]",
+        ast.BinOp: lambda self, a: (
+            f"{self._get_type_annotation(a.left)} | {self._get_type_annotation(a.right)}" if isinstance(a.op, ast.BitOr) else ""
+        ),
+        ast.Attribute: lambda self, a: f"{self._get_type_annotation(a.value)}.{a.attr}",
+        type(None): lambda _, __: "None",
+    }
 
     def generate_pyi(self) -> str:
-        lines = []
-        for class_name, full_class_name, base_classes, attributes, async_methods, methods, staticmethods, classmethods, properties in self.class_defs:
-            lines.append(f"class {class_name}({', '.join(base_classes)}):")
+        buf = io.StringIO()
+        w = buf.write
+        for i, (class_name, full_class_name, base_classes, attributes, async_methods, methods, staticmethods, classmethods, properties) in enumerate(
+            self.class_defs,
+        ):
+            if i:
+                w("\n")
+            w(f"class {class_name}({', '.join(base_classes)}):\n")
             for attr_name, attr_type in attributes:
-                lines.append(f"    {attr_name}: {attr_type}")
+                w(f"    {attr_name}: {attr_type}\n")
             for method_name, args, defaults, return_type in async_methods:
-                defaults = ["None"] * (len(args) - len(defaults)) + defaults  # noqa: PLW2901
-                args_str = ", ".join(
-                    [f"{name}: {ty}" + (f" = {default}" if default != "None" else "") for (name, ty), default in zip(args, defaults, strict=True)],
-                )
-                lines.append(f"    async def {method_name}(self: {full_class_name}, {args_str}) -> {return_type}: ...")
+                w(f"    async def {method_name}(self: {full_class_name}, {_format_args(args, defaults)}) -> {return_type}: ...\n")
             for method_name, posonlyargs, args, defaults, return_type in methods:
-                defaults = ["None"] * (len(args) - len(defaults)) + defaults  # noqa: PLW2901
-                posonlyargs_str = ", ".join([f"{name}: {ty}" for name, ty in posonlyargs])
-                args_str = ", ".join(
-                    [f"{name}: {ty}" + (f" = {default}" if default != "None" else "") for (name, ty), default in zip(args, defaults, strict=True)],
-                )
-                if posonlyargs_str:
-                    args_str = posonlyargs_str + ", /, " + args_str
+                args_str = _format_args(args, defaults)
+                if posonlyargs:
+                    args_str = _format_args(posonlyargs) + ", /, " + args_str
                 if method_name == "__new__":
-                    lines.append(f"    def {method_name}(cls, {args_str}) -> {return_type}: ...")
+                    w(f"    def {method_name}(cls, {args_str}) -> {return_type}: ...\n")
                 elif method_name == "__init__" and class_name == "FociSTM":
-                    lines.append(f"    def {method_name}(self: {class_name}, {args_str}) -> {return_type}: ...")
+                    w(f"    def {method_name}(self: {class_name}, {args_str}) -> {return_type}: ...\n")
                 else:
-                    lines.append(f"    def {method_name}(self: {full_class_name}, {args_str}) -> {return_type}: ...")
+                    w(f"    def {method_name}(self: {full_class_name}, {args_str}) -> {return_type}: ...\n")
             for method_name, args, return_type in staticmethods:
-                args_str = ", ".join([f"{name}: {ty}" for name, ty in args])
-                lines.append("    @staticmethod")
-                lines.append(f"    def {method_name}({args_str}) -> {return_type}: ...")
+                w(f"    @staticmethod\n    def {method_name}({_format_args(args)}) -> {return_type}: ...\n")
             for method_name, args, return_type in classmethods:
-                args_str = ", ".join([f"{name}: {ty}" for name, ty in args])
-                lines.append("    @classmethod")
-                lines.append(f"    def {method_name}(cls, {args_str}) -> {return_type}: ...")
+                w(f"    @classmethod\n    def {method_name}(cls, {_format_args(args)}) -> {return_type}: ...\n")
             for prop_name, prop_type in properties:
-                lines.append("    @property")
-                lines.append(f"    def {prop_name}(self: {full_class_name}) -> {prop_type}: ...")
-            lines.append("")
-        return "\n".join(lines)
+                w(f"    @property\n    def {prop_name}(self: {full_class_name}) -> {prop_type}: ...\n")
+        return buf.getvalue()
+
+
+def _format_args(args: list[tuple[str, str]], defaults: list | None = None) -> str:
+    if not defaults:
+        return ", ".join(f"{name}: {ty}" for name, ty in args)
+    defaults = ["None"] * (len(args) - len(defaults)) + defaults
+    return ", ".join(
+        f"{name}: {ty} = {default}" if default != "None" else f"{name}: {ty}" for (name, ty), default in zip(args, defaults, strict=True)
+    )